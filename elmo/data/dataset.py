@@ -1,59 +1,478 @@
+import os
 import glob
+import fnmatch
+import hashlib
+import tempfile
 import random
+import queue
+import itertools
+import threading
+import multiprocessing
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from mindspore.log import logging
 
+try:
+    import numba
+except ImportError:
+    numba = None
 
-def _get_batch(generator, batch_size, num_steps, max_word_length):
+# char ids stay below 300 (bytes plus a few special chars), so they are
+# stored and batched as uint16 and only widened at the device boundary
+_CHAR_DTYPE = np.uint16
+
+# shards with fewer sentences are encoded in the calling process
+_MIN_SENTENCES_TO_PARALLELIZE = 1000
+_ENCODE_CHUNKSIZE = 512
+_WARM_CACHE_THREADS = 32
+
+_worker_vocab = None
+
+
+def _init_encode_worker(vocab):
+    global _worker_vocab
+    _worker_vocab = vocab
+
+
+def _read_lines(filename):
     """
-    Read batches of input.
+    Read the lines of a text file as bytes. They are decoded one at a time
+    when encoded, and bytes lines are smaller than str ones.
     """
-    cur_stream = [None] * batch_size
-    no_more_data = False
+    with open(filename, 'rb') as f:
+        return f.readlines()
 
-    while True:
+
+def _warm_page_cache(filename):
+    """
+    Ask the kernel to read a file into the page cache in the background.
+    """
+    try:
+        fd = os.open(filename, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _vocab_fingerprint(vocab, use_char_inputs):
+    """
+    Hash everything the encoding of a shard depends on: the words of the
+    vocabulary, in order, and the char inputs settings.
+    """
+    digest = hashlib.sha1()
+    for i in range(vocab.size):
+        digest.update(vocab.id_to_word(i).encode('utf-8') + b'\n')
+    if use_char_inputs:
+        digest.update(b'chars %d' % vocab.max_word_length)
+    return digest.hexdigest()[:16]
+
+
+def _encoded_cache_paths(shard_name, fingerprint):
+    prefix = '%s.encoded.%s' % (shard_name, fingerprint)
+    return {name: '%s.%s.npy' % (prefix, name) for name in ('tokens', 'chars', 'offsets')}
+
+
+# the patterns also match the temporary files of an interrupted save
+_ENCODED_CACHE_PATTERNS = [path + '*' for path in _encoded_cache_paths('*', '*').values()]
+
+
+def _is_encoded_cache(filename):
+    return any(fnmatch.fnmatchcase(filename, pattern) for pattern in _ENCODED_CACHE_PATTERNS)
+
+
+def _has_encoded_cache(shard_name, fingerprint, use_char_inputs):
+    paths = _encoded_cache_paths(shard_name, fingerprint)
+    if not use_char_inputs:
+        del paths['chars']
+    if not all(os.path.exists(path) for path in paths.values()):
+        return False
+    # offsets are written last, so they mark a complete cache
+    return os.path.getmtime(paths['offsets']) >= os.path.getmtime(shard_name)
+
+
+def _save_encoded(shard_name, fingerprint, shard):
+    """
+    Save an encoded shard: the flat token and char arrays plus the
+    offsets of the sentence boundaries.
+
+    Every array is written to a temporary file of its own and renamed
+    into place, so processes saving the same shard at once do not clash.
+    """
+    paths = _encoded_cache_paths(shard_name, fingerprint)
+    tokens, chars, offsets = shard
+    arrays = [('tokens', tokens)]
+    if chars is not None:
+        arrays.append(('chars', chars))
+    arrays.append(('offsets', offsets))
+
+    for name, array in arrays:
+        path = paths[name]
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                        dir=os.path.dirname(path) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def _load_encoded(shard_name, fingerprint, use_char_inputs):
+    """
+    Load a shard saved by _save_encoded, with the token and char arrays
+    as read-only memory maps.
+    """
+    paths = _encoded_cache_paths(shard_name, fingerprint)
+    offsets = np.load(paths['offsets'])
+    tokens = np.load(paths['tokens'], mmap_mode='r')
+    chars = np.load(paths['chars'], mmap_mode='r') if use_char_inputs else None
+    return tokens, chars, offsets
+
+
+def _encode_sentence(vocab, sentence):
+    if isinstance(sentence, bytes):
+        sentence = sentence.decode('utf-8')
+    ids = np.asarray(vocab.encode(sentence), dtype=np.int32)
+    if hasattr(vocab, 'encode_chars'):
+        chars_ids = np.asarray(vocab.encode_chars(sentence), dtype=_CHAR_DTYPE)
+    else:
+        chars_ids = None
+    return ids, chars_ids
+
+
+def _encode_sentences(vocab, sentences):
+    """
+    Encode sentences into one flat token array, one flat char array (None
+    without char inputs) and the offsets of the sentence boundaries, so a
+    shard costs a few large arrays instead of two per sentence.
+    """
+    ids = [_encode_sentence(vocab, sentence) for sentence in sentences]
+    offsets = np.zeros(len(ids) + 1, np.int64)
+    np.cumsum([len(token_ids) for token_ids, _ in ids], out=offsets[1:])
+    tokens = np.concatenate([token_ids for token_ids, _ in ids] + [np.zeros(0, np.int32)])
+    if hasattr(vocab, 'encode_chars'):
+        chars = np.concatenate([chars_ids for _, chars_ids in ids] +
+                               [np.zeros([0, vocab.max_word_length], _CHAR_DTYPE)])
+    else:
+        chars = None
+    return tokens, chars, offsets
+
+
+def _encode_chunk(sentences):
+    return _encode_sentences(_worker_vocab, sentences)
+
+
+def _concat_shards(shards):
+    tokens = np.concatenate([shard[0] for shard in shards])
+    if shards[0][1] is not None:
+        chars = np.concatenate([shard[1] for shard in shards])
+    else:
+        chars = None
+    offsets = [np.zeros(1, np.int64)]
+    size = 0
+    for shard in shards:
+        offsets.append(shard[2][1:] + size)
+        size += shard[2][-1]
+    return tokens, chars, np.concatenate(offsets)
+
+
+def _range_index(starts, lengths):
+    """
+    Indices of the ranges [start, start + length) laid out back to back,
+    and the offsets of the ranges in that layout.
+    """
+    offsets = np.zeros(len(lengths) + 1, np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1]), offsets
+
+
+def _permute_shard(shard, order):
+    """
+    Reorder the sentences of a shard, with one vectorized gather.
+    """
+    tokens, chars, offsets = shard
+    order = np.asarray(order, np.int64)
+    index, new_offsets = _range_index(offsets[:-1][order], np.diff(offsets)[order])
+    return tokens[index], chars[index] if chars is not None else None, new_offsets
+
+
+def _shuffle_shard(shard):
+    order = list(range(len(shard[2]) - 1))
+    random.shuffle(order)
+    return _permute_shard(shard, order)
+
+
+def _reverse_block(block):
+    """
+    The encoding of a reversed sentence, <S> w1 ... wn </S> becoming
+    </S> wn ... w1 <S>, is the forward encoding read backwards, so the
+    reverse direction reverses every sentence of a block in place, with
+    one vectorized gather.
+    """
+    tokens, chars, offsets = block
+    index = np.repeat(offsets[:-1] + offsets[1:] - 1, np.diff(offsets)) - np.arange(offsets[-1])
+    return tokens[index], chars[index] if chars is not None else None, offsets
+
+
+def _block_sentences(block):
+    tokens, chars, offsets = block
+    bounds = offsets.tolist()
+    return [(tokens[s:e], chars[s:e] if chars is not None else None)
+            for s, e in zip(bounds[:-1], bounds[1:])]
+
+
+def _fill_batch(inputs, char_inputs, targets, tokens, chars, bounds, next_sentence,
+                row_pos, row_end, use_chars, row, cur_pos):
+    """
+    Fill the rows of a batch from their sentence streams, starting at
+    position cur_pos of row and taking a new sentence from the pool
+    whenever a row's current one is used up.
+
+    tokens, chars and bounds hold the pool sentences back to back;
+    row_pos and row_end are the pool positions of the next unread token
+    of each row's current sentence and of its end. Returns the next pool
+    sentence to hand out and the row and position reached, which is the
+    end of the batch unless the pool ran out of sentences.
+
+    Compiled with numba when it is installed.
+    """
+    batch_size, num_steps = inputs.shape
+    n_sentences = len(bounds) - 1
+    while row < batch_size:
+        while cur_pos < num_steps:
+            if row_end[row] - row_pos[row] <= 1:
+                if next_sentence == n_sentences:
+                    return next_sentence, row, cur_pos
+                row_pos[row] = bounds[next_sentence]
+                row_end[row] = bounds[next_sentence + 1]
+                next_sentence += 1
+
+            start = row_pos[row]
+            how_many = min(row_end[row] - start - 1, num_steps - cur_pos)
+            next_pos = cur_pos + how_many
+
+            inputs[row, cur_pos:next_pos] = tokens[start:start + how_many]
+            if use_chars:
+                char_inputs[row, cur_pos:next_pos] = chars[start:start + how_many]
+
+            targets[row, cur_pos:next_pos] = tokens[start + 1:start + how_many + 1]
+
+            cur_pos = next_pos
+            row_pos[row] += how_many
+        row += 1
+        cur_pos = 0
+    return next_sentence, row, cur_pos
+
+
+if numba is not None:
+    _fill_batch = numba.njit(nogil=True, cache=True)(_fill_batch)
+
+
+class _SentencePool(object):
+    """
+    Sentences waiting to be copied into batches, stored as flat token and
+    char arrays plus the boundaries of the sentences.
+    """
+    def __init__(self, blocks, char_width):
+        self._blocks = blocks
+        self.tokens = np.zeros(0, np.int32)
+        self.chars = np.zeros([0, char_width], _CHAR_DTYPE) if char_width else None
+        self.bounds = np.zeros(1, np.int64)
+        self.next_sentence = 0
+        self.exhausted = False
+
+    def available(self):
+        """
+        Number of batch positions the sentences not handed out yet can fill.
+        """
+        n_sentences = len(self.bounds) - 1 - self.next_sentence
+        return int(self.bounds[-1] - self.bounds[self.next_sentence]) - n_sentences
+
+    def refill(self, row_pos, row_end, min_positions):
+        """
+        Fetch blocks of sentences until the pool can fill at least
+        min_positions.
+
+        The pool is rebuilt from the unread rest of every row's current
+        sentence, the sentences not handed out yet and the new blocks;
+        row_pos and row_end are moved to the new pool in place.
+        """
+        blocks = []
+        available = self.available()
+        while available < min_positions:
+            block = next(self._blocks, None)
+            if block is None:
+                self.exhausted = True
+                break
+            blocks.append(block)
+            available += len(block[0]) - (len(block[2]) - 1)
+
+        # the rows become the first sentences of the new pool
+        index, row_bounds = _range_index(row_pos, row_end - row_pos)
+        rows = (self.tokens[index], self.chars[index] if self.chars is not None else None,
+                row_bounds)
+        first = self.bounds[self.next_sentence]
+        rest = (self.tokens[first:], self.chars[first:] if self.chars is not None else None,
+                self.bounds[self.next_sentence:] - first)
+
+        self.tokens, self.chars, self.bounds = _concat_shards([rows, rest] + blocks)
+        self.next_sentence = len(row_pos)
+        row_pos[:] = row_bounds[:-1]
+        row_end[:] = row_bounds[1:]
+
+
+def _get_batch(blocks, batch_size, num_steps, max_word_length, copy=True, num_buffers=1):
+    """
+    Read batches of input from an iterator over blocks of sentences, as
+    returned by LMDataset.fetch_block.
+
+    The batch buffers are allocated once and reused for every batch. Every
+    yielded batch overwrites all rows completely (an incomplete batch is
+    dropped), so the buffers never need to be cleared. With copy=False the
+    yielded arrays are the shared buffers themselves; batches are written
+    round-robin into num_buffers sets of buffers, so a batch is only
+    overwritten num_buffers batches later.
+    """
+    use_chars = max_word_length is not None
+    pool = _SentencePool(blocks, max_word_length if use_chars else 0)
+    # per-row sentence streams, as pool positions of the next unread token
+    # and of the end of the row's current sentence
+    row_pos = np.zeros(batch_size, np.int64)
+    row_end = np.zeros(batch_size, np.int64)
+    batch_positions = batch_size * num_steps
+    steps = np.arange(num_steps)
+
+    buffers = []
+    for _ in range(num_buffers):
         inputs = np.zeros([batch_size, num_steps], np.int32)
-        if max_word_length is not None:
-            char_inputs = np.zeros([batch_size, num_steps, max_word_length], np.int32)
+        if use_chars:
+            char_inputs = np.zeros([batch_size, num_steps, max_word_length], _CHAR_DTYPE)
         else:
             char_inputs = None
-
         targets = np.zeros([batch_size, num_steps], np.int32)
-        for i in range(batch_size):
-            cur_pos = 0
-            while cur_pos < num_steps:
-                if cur_stream[i] is None or len(cur_stream[i][0]) <= 1:
-                    try:
-                        cur_stream[i] = list(next(generator))
-                    except StopIteration:
-                        no_more_data = True
-                        break
-                
-                how_many = min(len(cur_stream[i][0]) - 1, num_steps - cur_pos)
-                next_pos = cur_pos + how_many
+        buffers.append((inputs, char_inputs, targets))
+    # numba needs arrays even when there are no char inputs
+    no_char_inputs = np.zeros([0, 0, 0], _CHAR_DTYPE)
+    no_chars = np.zeros([0, 0], _CHAR_DTYPE)
 
-                inputs[i, cur_pos:next_pos] = cur_stream[i][0][:how_many]
-                if max_word_length is not None:
-                    char_inputs[i, cur_pos:next_pos] = cur_stream[i][1][:how_many]
+    n_batches = 0
+    while True:
+        inputs, char_inputs, targets = buffers[n_batches % num_buffers]
+        n_batches += 1
 
-                targets[i, cur_pos:next_pos] = cur_stream[i][0][1:how_many+1]
-                
-                cur_pos = next_pos
+        # keep about two batches worth of sentences in the pool so that it
+        # is rebuilt at most every other batch
+        if not pool.exhausted and pool.available() < batch_positions:
+            pool.refill(row_pos, row_end, 2 * batch_positions)
+
+        # when every row's current sentence spans the whole batch, no
+        # sentence boundary is crossed and the rows are gathered at once
+        if (row_end - row_pos).min() > num_steps:
+            index = row_pos[:, None] + steps
+            np.take(pool.tokens, index, out=inputs)
+            np.take(pool.tokens, index + 1, out=targets)
+            if use_chars:
+                np.take(pool.chars, index, axis=0, out=char_inputs)
+            row_pos += num_steps
+            row = batch_size
+        else:
+            row = 0
 
-                cur_stream[i][0] = cur_stream[i][0][how_many:]
-                if max_word_length is not None:
-                    cur_stream[i][1] = cur_stream[i][1][how_many:]
+        cur_pos = 0
+        while row < batch_size:
+            pool.next_sentence, row, cur_pos = _fill_batch(
+                inputs, char_inputs if use_chars else no_char_inputs, targets,
+                pool.tokens, pool.chars if use_chars else no_chars, pool.bounds, pool.next_sentence,
+                row_pos, row_end, use_chars, row, cur_pos)
+            if row == batch_size or pool.exhausted:
+                break
+            pool.refill(row_pos, row_end, 2 * batch_positions)
 
-        if no_more_data:
+        if row < batch_size:
             # There is no more data.  Note: this will not return data
             # for the incomplete batch
             break
 
-        X = {'token_ids': inputs, 'tokens_characters': char_inputs,
+        if copy:
+            X = {'token_ids': inputs.copy(),
+                 'tokens_characters': char_inputs.copy() if char_inputs is not None else None,
+                 'next_token_id': targets.copy()}
+        else:
+            X = {'token_ids': inputs, 'tokens_characters': char_inputs,
                  'next_token_id': targets}
 
         yield X                
                 
+def _num_batch_buffers(prefetch):
+    # with prefetching, one batch is held by the caller, up to prefetch are
+    # queued and one is being filled
+    return prefetch + 2 if prefetch > 0 else 1
+
+
+_PREFETCH_POLL_SECONDS = 0.1
+
+
+def _prefetch(iterator, depth, closed=None):
+    """
+    Run iterator in a background thread, keeping up to depth items ready.
+    Exceptions raised by the iterator are re-raised in the consumer.
+
+    The thread stops once the consumer stops iterating, also on close()
+    or garbage collection of this generator, or once closed is set.
+    """
+    items = queue.Queue(maxsize=depth)
+    end = object()
+    stop = threading.Event()
+
+    def stopped():
+        return stop.is_set() or (closed is not None and closed.is_set())
+
+    def put(item):
+        while not stopped():
+            try:
+                items.put(item, timeout=_PREFETCH_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((end, e))
+        else:
+            put((end, None))
+
+    thread = threading.Thread(target=produce, name='batch-prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                break
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _add_reverse(X, Xr):
+    for k, v in Xr.items():
+        X[k + '_reverse'] = v
+    return X
+
+
 class LMDataset(object):
     """
     Hold a language model dataset.
@@ -61,20 +480,85 @@ class LMDataset(object):
     A dataset is a list of tokenized files. Each file contains one sentence per line.
     Each sentence is pre-tokenized and white space jointed
     """
-    def __init__(self, filepattern, vocab, test=False, shuffle_on_load=False, reverse=False):
+    def __init__(self, filepattern, vocab, test=False, shuffle_on_load=False, reverse=False,
+                 num_workers=1, fetch_factor=1, cache_encoded=False):
         self._vocab = vocab
-        self._all_shards = glob.glob(filepattern)
+        # skip the encoded caches in case the pattern also matches them
+        self._all_shards = [shard_name for shard_name in glob.glob(filepattern)
+                            if not _is_encoded_cache(shard_name)]
         logging.info('Found %d shards at %s' % (len(self._all_shards), filepattern))
         self._shards_to_choose = []
+        # shards found to hold no sentences; outside test mode shards are
+        # drawn forever, so running out of non-empty ones is an error
+        self._empty_shards = set()
         self._reverse = reverse
 
         self._test = test
         self._shuffle_on_load = shuffle_on_load
         self._use_char_inputs = hasattr(vocab, 'encode_chars')
+        # encoded shards are saved next to the text files and reused when
+        # they are newer than the shard. The file names carry a fingerprint
+        # of the vocab, so a changed vocab encodes the shards again.
+        self._cache_encoded = cache_encoded
+        if cache_encoded:
+            self._cache_fingerprint = _vocab_fingerprint(vocab, self._use_char_inputs)
 
-        self._ids = self._load_random_shard()
+        # with num_workers > 1, large shards are encoded by a pool of worker
+        # processes (num_workers=None uses one per cpu). The workers are
+        # started from a fork server where there is one, since the threads
+        # of other datasets may be running when this one is created. As with
+        # spawn, the main module then has to be import-safe.
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        if num_workers > 1:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+            else:
+                context = multiprocessing.get_context()
+            self._pool = context.Pool(num_workers, initializer=_init_encode_worker,
+                                      initargs=(vocab,))
+        else:
+            self._pool = None
+
+        # opening a shard is slow on networked file systems, so all of them
+        # are opened up front, concurrently, and their pages requested.
+        if not test and hasattr(os, 'posix_fadvise'):
+            self._warm_shards()
+
+        # fetch_factor shards are loaded together and their sentences are
+        # mixed. The next group is loaded in the background while the
+        # current one is consumed.
+        self._fetch_factor = fetch_factor
+        self._executor = ThreadPoolExecutor(max_workers=fetch_factor)
+        self._closed = threading.Event()
+        self._next_shard_futures = []
+
+        self._load_random_shard()
         
 
+    def _shard_files(self, shard_name):
+        if self._has_encoded_cache(shard_name):
+            paths = _encoded_cache_paths(shard_name, self._cache_fingerprint)
+            if not self._use_char_inputs:
+                del paths['chars']
+            return list(paths.values())
+        return [shard_name]
+
+    def _has_encoded_cache(self, shard_name):
+        return self._cache_encoded and _has_encoded_cache(shard_name, self._cache_fingerprint,
+                                                          self._use_char_inputs)
+
+    def _warm_shard(self, shard_name):
+        for filename in self._shard_files(shard_name):
+            _warm_page_cache(filename)
+
+    def _warm_shards(self):
+        executor = ThreadPoolExecutor(max_workers=_WARM_CACHE_THREADS)
+        for shard_name in self._all_shards:
+            executor.submit(self._warm_shard, shard_name)
+        # the readahead only has to finish before the shards are loaded
+        executor.shutdown(wait=False)
+
     def _choose_random_shard(self):
         if len(self._shards_to_choose) == 0:
             self._shards_to_choose = list(self._all_shards)
@@ -82,51 +566,112 @@ class LMDataset(object):
         shard_name = self._shards_to_choose.pop()
         return shard_name
 
-    def _load_random_shard(self):
+    def _next_shard_name(self):
         if self._test:
             if len(self._all_shards) == 0:
-                raise StopIteration
-            else:
-                shard_name = self._all_shards.pop()
+                return None
+            return self._all_shards.pop()
+        return self._choose_random_shard()
+
+    def _submit_next_shards(self):
+        futures = []
+        while len(futures) < self._fetch_factor:
+            shard_name = self._next_shard_name()
+            if shard_name is None:
+                break
+            futures.append(self._executor.submit(self._load_shard, shard_name))
+        return futures
+
+    def _load_random_shard(self):
+        futures = self._next_shard_futures or self._submit_next_shards()
+        if len(futures) == 0:
+            raise StopIteration
+        shards = [future.result() for future in futures]
+        self._next_shard_futures = self._submit_next_shards()
+        # shuffled here rather than in the loader threads, so that a seeded
+        # random module gives the same order every run
+        if self._shuffle_on_load:
+            shards = [_shuffle_shard(shard) for shard in shards]
+
+        if len(shards) == 1:
+            shard = shards[0]
         else:
-            shard_name = self._choose_random_shard()
-        
-        ids = self._load_shard(shard_name)
+            shard = _concat_shards(shards)
+            if not self._test:
+                shard = _shuffle_shard(shard)
+
+        self._shard = shard
         self._i = 0
-        self._nids = len(ids)
-        return ids
+        self._nids = len(shard[2]) - 1
+        if self._nids == 0 and not self._test and \
+                len(self._empty_shards) == len(self._all_shards):
+            raise ValueError('All %d shards are empty' % len(self._all_shards))
     
     def _load_shard(self, shard_name):
         logging.info('Loading data from: %s' % shard_name)
-        with open(shard_name) as f:
-            sentences = f.readlines()
+        if self._has_encoded_cache(shard_name):
+            shard = _load_encoded(shard_name, self._cache_fingerprint, self._use_char_inputs)
+        else:
+            shard = self._encode_shard(shard_name)
+            if self._cache_encoded:
+                _save_encoded(shard_name, self._cache_fingerprint, shard)
+
+        if len(shard[2]) == 1:
+            self._empty_shards.add(shard_name)
+        logging.info('Loaded %d sentences.' % (len(shard[2]) - 1))
+        return shard
+
+    def _encode_shard(self, shard_name):
+        sentences = _read_lines(shard_name)
+        if self._pool is not None and len(sentences) >= _MIN_SENTENCES_TO_PARALLELIZE:
+            chunks = [sentences[i:i + _ENCODE_CHUNKSIZE]
+                      for i in range(0, len(sentences), _ENCODE_CHUNKSIZE)]
+            return _concat_shards(self._pool.map(_encode_chunk, chunks))
+        return _encode_sentences(self.vocab, sentences)
 
+    def _take(self, k):
+        end = min(self._i + k, self._nids)
+        tokens, chars, offsets = self._shard
+        start, stop = offsets[self._i], offsets[end]
+        block = (tokens[start:stop], chars[start:stop] if chars is not None else None,
+                 offsets[self._i:end + 1] - start)
+        self._i = end
         if self._reverse:
-            sentences_reverse = []
-            for sentence in sentences:
-                splitted = sentence.split()
-                splitted.reverse()
-                sentences_reverse.append(' '.join(splitted))
-            sentences = sentences_reverse
+            block = _reverse_block(block)
+        return block
+
+    def fetch_block(self, k):
+        """
+        Return up to k sentences as one (tokens, chars, offsets) block: the
+        flat token and char arrays of the sentences and the offsets of
+        their boundaries. Loads the next shard once the current one is
+        used up; returns None once a test set is exhausted.
+        """
+        while self._i == self._nids:
+            try:
+                self._load_random_shard()
+            except StopIteration:
+                return None
+        return self._take(k)
+
+    def fetch_many(self, k):
+        """
+        Return up to k sentences as a list of (token_ids, char_ids). An
+        empty list means a test set is exhausted.
+        """
+        block = self.fetch_block(k)
+        if block is None:
+            return []
+        return _block_sentences(block)
+
+    def iter_blocks(self, k):
+        return iter(lambda: self.fetch_block(k), None)
 
-        if self._shuffle_on_load:
-            random.shuffle(sentences)
-        
-        ids = [self.vocab.encode(sentence, self._reverse) for sentence in sentences]
-        if self._use_char_inputs:
-            chars_ids = [self.vocab.encode_chars(sentence, self._reverse) for sentence in sentences]
-        else:
-            chars_ids = [None] * len(ids)
-        logging.info('Loaded %d sentences.' % len(ids))
-        return list(zip(ids, chars_ids))
-    
     def get_sentence(self):
         while True:
-            if self._i == self._nids:
-                self._ids = self._load_random_shard()
-            ret = self._ids[self._i]
-            self._i += 1
-            yield ret
+            while self._i == self._nids:
+                self._load_random_shard()
+            yield _block_sentences(self._take(1))[0]
 
     @property
     def max_word_length(self):
@@ -135,36 +680,79 @@ class LMDataset(object):
         else:
             return None
     
-    def iter_batches(self, batch_size, num_steps):
-        for X in _get_batch(self.get_sentence(), batch_size, num_steps, 
-                            self.max_word_length):
-            # token_ids(batch_size, num_steps)
-            # char_inputs = (batch_size, num_steps, max_word_length)
-            # targets = Word id of next word (batch_size, num_steps)
-            yield X
+    def iter_batches(self, batch_size, num_steps, copy=True, prefetch=0):
+        """
+        With prefetch > 0, up to that many batches are assembled ahead in a
+        background thread while the caller consumes the current one.
+        """
+        batches = _get_batch(self.iter_blocks(batch_size), batch_size, num_steps,
+                             self.max_word_length, copy=copy,
+                             num_buffers=_num_batch_buffers(prefetch))
+        if prefetch > 0:
+            batches = _prefetch(batches, prefetch, self._closed)
+        # token_ids(batch_size, num_steps)
+        # char_inputs = (batch_size, num_steps, max_word_length)
+        # targets = Word id of next word (batch_size, num_steps)
+        # yield from closes the prefetch thread together with this generator
+        yield from batches
     
     @property
     def vocab(self):
         return self._vocab
+
+    def close(self):
+        """
+        Stop loading shards in the background and shut down the encoding
+        worker processes.
+        """
+        # stops the prefetch threads of iterators that are still open
+        self._closed.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
     
 class BidirectionalLMDataset(object):
-    def __init__(self, filepattern, vocab, test=False, shuffle_on_load=False):
+    def __init__(self, filepattern, vocab, test=False, shuffle_on_load=False, **kwargs):
         '''
         bidirectional version of LMDataset
+
+        Both directions read the same sentences: the backward stream is
+        the forward one with every sentence reversed, so each shard is
+        only loaded and encoded once.
         '''
-        self._data_forward = LMDataset(filepattern, vocab, test=test, reverse=False,
-                                        shuffle_on_load=shuffle_on_load)
-        self._data_backward = LMDataset(filepattern, vocab, test=test, reverse=True,
-                                        shuffle_on_load=shuffle_on_load)
+        self._data = LMDataset(filepattern, vocab, test=test,
+                               shuffle_on_load=shuffle_on_load, **kwargs)
                                         
-    def iter_batches(self, batch_size, num_steps):
-        max_word_length = self._data_forward.max_word_length
-        for X, Xr in zip(
-            _get_batch(self._data_forward.get_sentence(), batch_size,
-                        num_steps, max_word_length),
-            _get_batch(self._data_backward.get_sentence(), batch_size,
-                        num_steps, max_word_length)
-        ):
-            for k, v in Xr.items():
-                X[k + '_reverse'] = v
-            yield X
\ No newline at end of file
+    def iter_batches(self, batch_size, num_steps, copy=True, prefetch=0):
+        max_word_length = self._data.max_word_length
+        # each sentence fills the same number of positions in both
+        # directions, so the two readers stay within a batch of each other
+        forward, backward = itertools.tee(self._data.iter_blocks(batch_size))
+        num_buffers = _num_batch_buffers(prefetch)
+        batches = zip(
+            _get_batch(forward, batch_size,
+                        num_steps, max_word_length, copy=copy, num_buffers=num_buffers),
+            _get_batch(map(_reverse_block, backward), batch_size,
+                        num_steps, max_word_length, copy=copy, num_buffers=num_buffers)
+        )
+        batches = (_add_reverse(X, Xr) for X, Xr in batches)
+        if prefetch > 0:
+            batches = _prefetch(batches, prefetch, self._data._closed)
+        yield from batches
+
+    def close(self):
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,6 +1,7 @@
 import os
 import json
 import argparse
+import numpy as np
 from mindspore.mindrecord import FileWriter
 from mindspore.log import logging
 import mindspore.common.dtype as mstype
@@ -36,19 +37,19 @@ class BaseReader(object):
         data = []
         n_tokens_per_batch = self.batch_size * self.num_steps
         n_total_batchs = self.n_train_token / n_tokens_per_batch
-        data_gen = self.get_data_batches(input_file, vocab_file)
-        for batch_no, batch in enumerate(data_gen.iter_batches(self.batch_size, self.num_steps)):
-            for i in range(self.batch_size):
-                sample = {
-                    "tokens_characters": batch['tokens_characters'][i],
-                    "tokens_characters_reverse": batch['tokens_characters_reverse'][i],
-                    "next_token_id": batch['next_token_id'][i],
-                    "next_token_id_reverse": batch['next_token_id_reverse'][i]
-                }
-                
-                data.append(sample)
-            if batch_no >= n_total_batchs:
-                break
+        with self.get_data_batches(input_file, vocab_file) as data_gen:
+            for batch_no, batch in enumerate(data_gen.iter_batches(self.batch_size, self.num_steps)):
+                for i in range(self.batch_size):
+                    sample = {
+                        "tokens_characters": batch['tokens_characters'][i].astype(np.int32),
+                        "tokens_characters_reverse": batch['tokens_characters_reverse'][i].astype(np.int32),
+                        "next_token_id": batch['next_token_id'][i],
+                        "next_token_id_reverse": batch['next_token_id_reverse'][i]
+                    }
+                    
+                    data.append(sample)
+                if batch_no >= n_total_batchs:
+                    break
         writer.write_raw_data(data)
         writer.commit()
 
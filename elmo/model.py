@@ -20,6 +20,7 @@ class LanguageModel(nn.Cell):
         unroll_steps = self.options['unroll_steps']
         sample_softmax = self.options.get('sample_softmax', True)
         n_negative_samples_batch = self.options['n_negative_samples_batch']
+        mixed_precision = self.options.get('mixed_precision', False)
         # LSTM options
         lstm_dim = self.options['lstm']['dim']
         projection_dim = self.options['lstm']['projection_dim']
@@ -45,7 +46,8 @@ class LanguageModel(nn.Cell):
         self.char_embedding = CharacterEncoder(filters, n_filters, max_chars, char_embed_dim, n_chars, n_highway, projection_dim, activation)
         self.bilstm = ELMoLSTM(projection_dim, lstm_dim, projection_dim, n_lstm_layers, keep_prob, cell_clip, proj_clip, use_skip_connections, is_training=True, batch_first=True)
 
-        self.loss = LossCell(projection_dim, n_tokens_vocab, sample_softmax, n_negative_samples_batch, training=training)
+        self.loss = LossCell(projection_dim, n_tokens_vocab, sample_softmax, n_negative_samples_batch, training=training,
+                             mixed_precision=mixed_precision)
     
     def construct(self, inputs, inputs_backward, next_ids_forward, next_ids_backward):
         """
@@ -15,9 +15,11 @@ class LossCell(nn.Cell):
             num_sampled, 
             num_true=1,
             seed=0,
-            training=True):
+            training=True,
+            mixed_precision=False):
         super().__init__()
         self.training = training
+        self.mixed_precision = mixed_precision
         self.sample_softmax = sample_softmax
         self.hidden_size = hidden_size
 
@@ -28,18 +30,32 @@ class LossCell(nn.Cell):
         self.sparse_softmax_cross_entropy_with_logits = nn.SoftmaxCrossEntropyWithLogits(sparse=True)
         self.matmul = nn.MatMul(False, True)
         self.reduce_mean = P.ReduceMean()
+        self.reshape = P.Reshape()
+        self.concat = P.Concat(0)
+        self.cast = P.Cast()
     def construct(self, lstm_outputs, next_ids):
-        total_loss = []
-        for lstm_output, next_token_id in zip(lstm_outputs, next_ids):
-            next_token_id_flat = next_token_id.view((-1, 1))
-            if self.training and self.sample_softmax:
-                lstm_output = lstm_output.view((-1, self.hidden_size))
-                loss = self.sampled_softmax_loss(self.weight, self.bias, next_token_id_flat, lstm_output)
+        # both directions share the softmax, so they are scored together.
+        # The two halves have the same size, so the mean over all tokens is
+        # the average of the per-direction means.
+        lstm_output = self.concat((self.reshape(lstm_outputs[0], (-1, self.hidden_size)),
+                                   self.reshape(lstm_outputs[1], (-1, self.hidden_size))))
+        if self.training and self.sample_softmax:
+            next_token_id = self.concat((self.reshape(next_ids[0], (-1, 1)),
+                                         self.reshape(next_ids[1], (-1, 1))))
+            loss = self.sampled_softmax_loss(self.weight, self.bias, next_token_id, lstm_output)
+        else:
+            next_token_id = self.concat((self.reshape(next_ids[0], (-1,)),
+                                         self.reshape(next_ids[1], (-1,))))
+            if self.mixed_precision:
+                # float16 projection, the weight keeps a float32 master copy
+                # and the softmax runs in float32. The cast reads the full
+                # float32 weight on every call, so this speeds up the matmul
+                # but does not save weight bandwidth.
+                output_scores = self.matmul(self.cast(lstm_output, mindspore.float16),
+                                            self.cast(self.weight, mindspore.float16))
+                output_scores = self.cast(output_scores, mindspore.float32) + self.bias
             else:
-                next_token_id_flat = P.Squeeze(1)(next_token_id_flat)
                 output_scores = self.matmul(lstm_output, self.weight) + self.bias
-                output_scores = output_scores.view((-1, output_scores.shape[-1]))
-                loss = self.sparse_softmax_cross_entropy_with_logits(output_scores, next_token_id_flat)
-            total_loss.append(self.reduce_mean(loss))
-        
-        return 0.5 * (total_loss[0] + total_loss[1])
\ No newline at end of file
+            loss = self.sparse_softmax_cross_entropy_with_logits(output_scores, next_token_id)
+
+        return self.reduce_mean(loss)
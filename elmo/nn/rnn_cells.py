@@ -4,7 +4,7 @@ import numpy as np
 import mindspore.nn as nn
 import mindspore.ops as P
 from mindspore import Tensor, Parameter
-from mindspore.common.initializer import initializer, Uniform
+from mindspore.common.initializer import initializer, Uniform, Normal
 from elmo.utils.glorot_uniform import glorot_uniform
 from typing import Tuple
 
@@ -121,7 +121,7 @@ class LSTMCellWithProjection(RNNCellBase):
         self.proj_size = proj_size
         self.proj_clip = proj_clip
         if proj_size is not None:
-            self.proj_weight = Parameter(Tensor(np.random.randn(hidden_size, proj_size).astype(np.float32)))
+            self.proj_weight = Parameter(initializer(Normal(1.0), (hidden_size, proj_size), mindspore.float32))
 
         self.matmul = P.MatMul()
 
@@ -1,7 +1,11 @@
 import unittest
 import tempfile
+import glob
 import os
+import random
+import threading
 import numpy as np
+from unittest import mock
 
 from elmo.data.vocabulary import UnicodeCharsVocabulary, Vocabulary
 from elmo.data.dataset import LMDataset, BidirectionalLMDataset
@@ -252,6 +256,144 @@ class TestLMDataset(unittest.TestCase):
         expected = self._expected(True, False)
         self._compare(expected, batches)
 
+    def test_lm_dataset_no_copy(self):
+        data = self._load_data(False, True)
+        expected = self._expected(False, True)
+        batches = data.iter_batches(2, 3, copy=False)
+        first = next(batches)
+        self._compare([first], expected[:1])
+        token_ids = first['token_ids']
+        second = next(batches)
+        self.assertTrue(second['token_ids'] is token_ids)
+        self._compare([second], expected[1:])
+
+    def test_lm_dataset_char_dtype(self):
+        data = self._load_data(False, True)
+        batch = next(data.iter_batches(2, 3))
+        self.assertEqual(batch['tokens_characters'].dtype, np.uint16)
+        self.assertEqual(batch['token_ids'].dtype, np.int32)
+
+    def test_lm_dataset_prefetch(self):
+        data = self._load_data(False, True, True)
+        expected = self._expected(False, True, True)
+        batches = data.iter_batches(2, 3, prefetch=1)
+        self._compare([next(batches), next(batches)], expected)
+
+    def test_lm_dataset_prefetch_close(self):
+        def prefetch_threads():
+            return [t for t in threading.enumerate() if t.name == 'batch-prefetch']
+
+        data = self._load_data(False, True, True)
+        batches = data.iter_batches(2, 3, prefetch=1)
+        next(batches)
+        batches.close()
+        self.assertEqual(prefetch_threads(), [])
+
+        batches = data.iter_batches(2, 3, prefetch=1)
+        next(batches)
+        data.close()
+        for thread in prefetch_threads():
+            thread.join(5)
+        self.assertEqual(prefetch_threads(), [])
+
+    def test_lm_dataset_fetch_many(self):
+        vocab = Vocabulary(self._tmp_vocab)
+        data = LMDataset(self._tmp_train, vocab, test=True)
+        self.assertEqual([s[0].tolist() for s in data.fetch_many(2)], [[0, 3, 2, 4, 1], [0, 2, 4, 1]])
+        self.assertEqual([s[0].tolist() for s in data.fetch_many(2)], [[0, 3, 1]])
+        self.assertEqual(data.fetch_many(2), [])
+
+    def test_lm_dataset_within_sentences(self):
+        # with one step per batch most batches stay inside the rows' sentences
+        data = LMDataset(self._tmp_train, Vocabulary(self._tmp_vocab), test=True)
+        batches = list(data.iter_batches(2, 1))
+        self.assertEqual([b['token_ids'][:, 0].tolist() for b in batches],
+                         [[0, 0], [3, 2], [2, 4], [4, 0]])
+        self.assertEqual([b['next_token_id'][:, 0].tolist() for b in batches],
+                         [[3, 2], [2, 4], [4, 1], [1, 3]])
+
+    def test_lm_dataset_num_workers(self):
+        vocab = UnicodeCharsVocabulary(self._tmp_vocab, 5)
+        with LMDataset(self._tmp_train, vocab, test=True) as data:
+            expected = data.fetch_many(3)
+        with mock.patch('elmo.data.dataset._MIN_SENTENCES_TO_PARALLELIZE', 1), \
+                mock.patch('elmo.data.dataset._ENCODE_CHUNKSIZE', 2):
+            with LMDataset(self._tmp_train, vocab, test=True, num_workers=2) as data:
+                actual = data.fetch_many(3)
+        self.assertEqual(len(actual), len(expected))
+        for (token_ids, char_ids), (e_token_ids, e_char_ids) in zip(actual, expected):
+            self.assertEqual(token_ids.tolist(), e_token_ids.tolist())
+            self.assertTrue(np.all(char_ids == e_char_ids))
+
+    def test_lm_dataset_empty_shards(self):
+        (_, tmp_empty) = tempfile.mkstemp()
+        try:
+            with self.assertRaises(ValueError):
+                LMDataset(tmp_empty, Vocabulary(self._tmp_vocab))
+        finally:
+            os.remove(tmp_empty)
+
+    def test_lm_dataset_test_mode(self):
+        data = LMDataset(self._tmp_train, UnicodeCharsVocabulary(self._tmp_vocab, 5), test=True)
+        batches = list(data.iter_batches(2, 3))
+        self._compare(batches, self._expected(False, True)[:1])
+
+    def test_lm_dataset_fetch_factor(self):
+        vocab = Vocabulary(self._tmp_vocab)
+        data = LMDataset(self._tmp_train, vocab, fetch_factor=2)
+        sentences = data.get_sentence()
+        actual = sorted(next(sentences)[0].tolist() for _ in range(6))
+        expected = sorted([[0, 3, 2, 4, 1], [0, 2, 4, 1], [0, 3, 1]] * 2)
+        self.assertEqual(actual, expected)
+
+    def test_lm_dataset_shuffle_seeded(self):
+        vocab = Vocabulary(self._tmp_vocab)
+        orders = []
+        for _ in range(2):
+            random.seed(3)
+            with LMDataset(self._tmp_train, vocab, shuffle_on_load=True, fetch_factor=2) as data:
+                sentences = data.get_sentence()
+                orders.append([next(sentences)[0].tolist() for _ in range(12)])
+        self.assertEqual(orders[0], orders[1])
+
+    def test_lm_dataset_cache_encoded(self):
+        vocab = UnicodeCharsVocabulary(self._tmp_vocab, 5)
+        expected = self._expected(False, True)
+        try:
+            for _ in range(2):
+                data = LMDataset(self._tmp_train, vocab, cache_encoded=True)
+                batches = data.iter_batches(2, 3)
+                self._compare([next(batches), next(batches)], expected)
+                self.assertEqual(len(glob.glob(self._tmp_train + '.encoded.*.npy')), 3)
+        finally:
+            for path in glob.glob(self._tmp_train + '.encoded.*'):
+                os.remove(path)
+
+    def test_lm_dataset_cache_encoded_vocab_change(self):
+        # the same words with the ids of 'the' and '.' swapped
+        words = ['<S>', '</S>', '<UNK>', '.', 'the', chr(256) + 't']
+        (_, tmp_vocab) = tempfile.mkstemp()
+        with open(tmp_vocab, 'w') as fout:
+            fout.write('\n'.join(words))
+
+        sentences = ['the unknown .', 'th .', 'the']
+        vocabs = [Vocabulary(self._tmp_vocab), Vocabulary(tmp_vocab),
+                  UnicodeCharsVocabulary(tmp_vocab, 5), UnicodeCharsVocabulary(tmp_vocab, 7)]
+        try:
+            for vocab in vocabs:
+                data = LMDataset(self._tmp_train, vocab, test=True, cache_encoded=True)
+                actual = data.fetch_many(3)
+                for (token_ids, char_ids), sentence in zip(actual, sentences):
+                    self.assertEqual(token_ids.tolist(), vocab.encode(sentence).tolist())
+                    if char_ids is not None:
+                        self.assertTrue(np.all(char_ids == vocab.encode_chars(sentence)))
+                    else:
+                        self.assertFalse(hasattr(vocab, 'encode_chars'))
+        finally:
+            os.remove(tmp_vocab)
+            for path in glob.glob(self._tmp_train + '.encoded.*'):
+                os.remove(path)
+
     def test_bi_lm_dataset(self):
         for a1 in [True, False]:
             for a2 in [True, False]:
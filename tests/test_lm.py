@@ -10,6 +10,7 @@ from elmo.model import LanguageModel
 from elmo.data.vocabulary import Vocabulary, UnicodeCharsVocabulary
 from elmo.data.dataset import LMDataset, BidirectionalLMDataset
 from elmo.modules.embedding import CharacterEncoder
+from elmo.modules.loss import LossCell
 from elmo.nn.rnn_cells import LSTMCell
 from elmo.ops.sampled_softmax_loss import SampledSoftmaxLoss
 
@@ -91,4 +92,23 @@ class TestLanguageModel(unittest.TestCase):
             print(targets, targets_back)
             loss = lm(inputs, inputs_backward, targets, targets_back)
             if i==3:
-                break
\ No newline at end of file
+                break
+
+class TestLossCell(unittest.TestCase):
+    def test_loss_mixed_precision(self):
+        hidden_size, vocab_size = 16, 50
+        lstm_outputs = tuple(Tensor(np.random.randn(2, 3, hidden_size), mindspore.float32)
+                             for _ in range(2))
+        next_ids = tuple(Tensor(np.random.randint(0, vocab_size, (2, 3)), mindspore.int32)
+                         for _ in range(2))
+
+        loss_cell = LossCell(hidden_size, vocab_size, True, 8, training=False)
+        mixed_cell = LossCell(hidden_size, vocab_size, True, 8, training=False,
+                              mixed_precision=True)
+        mixed_cell.weight.set_data(Tensor(loss_cell.weight.asnumpy()))
+
+        loss = loss_cell(lstm_outputs, next_ids).asnumpy()
+        mixed_loss = mixed_cell(lstm_outputs, next_ids).asnumpy()
+        assert mixed_loss.dtype == np.float32
+        assert np.isfinite(mixed_loss)
+        assert np.allclose(mixed_loss, loss, rtol=1e-2)